@@ -5,55 +5,399 @@ import sys
 import SaveSystem
 from tkinter import filedialog
 import os
+import math
+import threading
+import queue
+from collections import OrderedDict
 
 # Grid Constants
 GRID_SIZE = 30
-GRID_ROW_COUNT = 51
-GRID_COLUMN_COUNT = 51
+CHUNK_SIZE = 16 # tiles are stored and rendered in square chunks of this many tiles, so only edited chunks have to be redrawn
+
+# Region Streaming Constants
+REGION_SIZE = 8 # each region file holds a square of REGION_SIZE x REGION_SIZE chunks
+REGION_LOAD_RADIUS = 1 # regions this many regions away from the camera's region are kept loaded
+REGION_MEMORY_BUDGET = 256 * 1024 * 1024 # bytes, least recently used regions are unloaded when the loaded tilemap uses more than this
+CHUNK_SURFACE_MEMORY_BUDGET = 128 * 1024 * 1024 # bytes, the least recently drawn chunk surfaces are thrown away when they use more than this, they are redrawn when needed
+FLOOD_FILL_CHUNK_RADIUS = 32 # flood fills cover at most this many chunks in each direction from the chunk they start in, so filling an open area ends
+QUEUED_REGION_WRITE_LIMIT = 16 # unloaded regions waiting to be written hold their tiles in memory, so no more than this many writes are queued at once
+
+# Layer Constants
+LAYER_NAMES = ["Background", "Terrain", "Decoration"] # layers are drawn in this order, so later layers are drawn on top
 
 # Font Constant
 ROBOTO_REGULAR_PATH = "Roboto/Roboto-Regular.ttf"
 
-class Tile: # class to store information about tile at position in grid
-    tilemap = [[None] * GRID_COLUMN_COUNT for i in range(GRID_ROW_COUNT)] # static 2d array 
-    def __init__(self, position, tileTemplate): # important to note that position refers to the position in the tilemap's grid (position >= 0, position has to be an integer)
+class Layer: # a layer of the tilemap, every layer caches its own render of each chunk
+    layers = []
+    activeLayer = 0 # index of the layer that tiles are painted on
 
-        self.position = position
-        self.tileTemplate = tileTemplate
-        Tile.tilemap[int(position.x)][int(position.y)] = self
-    def drawTile(self):
-        Camera.drawTexture(self.tileTemplate.texture, (self.position * GRID_SIZE) - pygame.Vector2(GRID_SIZE / 2, GRID_SIZE / 2), pygame.Vector2(GRID_SIZE, GRID_SIZE))
+    def onClick(self):
+        """This function is meant to be used in a Button, do not call this function directly"""
+        self.setVisible(not self.isVisible)
+
+    def __init__(self, name):
+        self.name = name
+        self.index = len(Layer.layers)
+        self.isVisible = True
+        self.chunkSurfaces = {} # cached render of this layer for every chunk that has tiles on this layer
+        self.dirtyChunks = set() # chunks of this layer that have to be redrawn before they are used next
+
+        # GUI stuff, the panel shows if the layer is visible and clicking it toggles the visibility
+        guiPos = pygame.Vector2(690 + 110 * self.index, 30)
+        self.panel = GuiLib.Panel(guiPos, pygame.Vector2(100, 40), (60, 240, 99))
+        self.text = GuiLib.Text(guiPos + pygame.Vector2(38, 8), 14, ROBOTO_REGULAR_PATH)
+        self.text.changeText(f"{self.index + 1}: {name}")
+        self.text.changeBackgroundColor((60, 240, 99))
+        self.button = GuiLib.Button(guiPos, pygame.Vector2(100, 40), None, self.onClick)
+
+        Layer.layers.append(self)
+
+    def setVisible(self, isVisible):
+        """Hidden layers are not redrawn or drawn at all, the chunks they have tiles in are composited again without them"""
+        self.isVisible = isVisible
+        color = (60, 240, 99) if isVisible else (230, 95, 85)
+        self.panel.changeColor(color)
+        self.text.changeBackgroundColor(color)
+        Tile.dirtyChunks.update(self.chunkSurfaces.keys())
+        Tile.dirtyChunks.update(self.dirtyChunks)
+
+    def redrawChunk(self, chunkPosition):
+        """Rebuilds the cached surface of this layer in a chunk from the tilemap"""
+        surface = None
+        for x, column in enumerate(Tile.chunks[chunkPosition][self.index]):
+            for y, tileTemplate in enumerate(column):
+                if tileTemplate == None or tileTemplate.gridTexture == None:
+                    continue
+                if surface == None:
+                    surface = pygame.Surface((CHUNK_SIZE * GRID_SIZE, CHUNK_SIZE * GRID_SIZE), pygame.SRCALPHA)
+                surface.blit(tileTemplate.gridTexture, (x * GRID_SIZE, y * GRID_SIZE))
+
+        if surface == None: # don't keep surfaces around for empty chunks
+            self.chunkSurfaces.pop(chunkPosition, None)
+        else:
+            self.chunkSurfaces[chunkPosition] = surface
+        self.dirtyChunks.discard(chunkPosition)
 
     @staticmethod
-    def addTile(gridPosition, tileTemplate):
-        """gridPosition is in tilemap coordinates, has to be >= 0 and an integer"""
-        if gridPosition.x >= 0 and gridPosition.x < GRID_COLUMN_COUNT and gridPosition.y >= 0 and gridPosition.y < GRID_ROW_COUNT:
-            return Tile(gridPosition, tileTemplate)
-        #else:
-            #print(f"Tile position at {gridPosition.x}, {gridPosition.y} is out of bounds!")
-    
+    def isValidIndex(index):
+        return isinstance(index, int) and index >= 0 and index < len(Layer.layers)
+
+    @staticmethod
+    def setActiveLayer(index):
+        Layer.layers[Layer.activeLayer].text.changeTextColor((0, 0, 0))
+        Layer.activeLayer = index
+        Layer.layers[index].text.changeTextColor((255, 255, 255))
+
+class Tile: # class to store the tilemap, each cell holds the TileTemplate painted there or None if it is empty
+    chunks = {} # the loaded part of the tilemap, chunk position -> one 2d array of CHUNK_SIZE x CHUNK_SIZE cells per layer, indexed with chunk[layer][x][y]
+    chunkSurfaces = {} # cached composite of the visible layers of every chunk that has tiles in it, the key is the chunk position
+    dirtyChunks = set() # chunks that have to be composited again before they are drawn next
+    surfaceUsage = OrderedDict() # chunk position -> None for loaded chunks that were drawn, ordered from least to most recently drawn
+    chunkSurfaceBytes = (CHUNK_SIZE * GRID_SIZE) ** 2 * 4 # 32 bit pixels
+
+    @staticmethod
+    def getTile(x, y, layer):
+        """Returns the tile template at the given grid position and layer index, or None if the cell is empty or not loaded"""
+        chunk = Tile.chunks.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+        if chunk == None:
+            return None
+        return chunk[layer][x % CHUNK_SIZE][y % CHUNK_SIZE]
+
+    @staticmethod
+    def getChunkForWriting(chunkPosition):
+        """Returns the chunk at chunkPosition, the region it is in is loaded right away if it is not loaded yet. Returns None if its region file can't be read.
+        The region is marked as changed right away, so bulk operations can unload it before they finish without losing the changes"""
+        regionPosition = (chunkPosition[0] // REGION_SIZE, chunkPosition[1] // REGION_SIZE)
+        chunk = Tile.chunks.get(chunkPosition)
+        if chunk == None:
+            if not RegionStreamer.loadRegionNow(regionPosition):
+                return None
+            chunk = Tile.chunks[chunkPosition]
+        RegionStreamer.loadedRegions.move_to_end(regionPosition)
+        RegionStreamer.dirtyRegions.add(regionPosition)
+        return chunk
+
+    @staticmethod
+    def markChunksDirty(chunkPositions, layer):
+        """Marks the given chunks of a layer as needing a redraw and their regions as needing a save, bulk operations should call this only once"""
+        for chunkPosition in chunkPositions:
+            if chunkPosition in Tile.chunks:
+                Layer.layers[layer].dirtyChunks.add(chunkPosition)
+                Tile.dirtyChunks.add(chunkPosition)
+                RegionStreamer.dirtyRegions.add((chunkPosition[0] // REGION_SIZE, chunkPosition[1] // REGION_SIZE))
+
+    @staticmethod
+    def markDirtyRect(startX, startY, endX, endY, layer):
+        """Marks every chunk of a layer overlapping the given (inclusive) rectangle of cells as dirty"""
+        Tile.markChunksDirty([(cx, cy) for cx in range(startX // CHUNK_SIZE, endX // CHUNK_SIZE + 1) for cy in range(startY // CHUNK_SIZE, endY // CHUNK_SIZE + 1)], layer)
+
+    @staticmethod
+    def setCells(cells, tileTemplate, layer):
+        """Sets every (x, y) cell given on a layer to tileTemplate (None removes the tiles)"""
+        dirtyChunks = set()
+        for x, y in cells:
+            chunkPosition = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+            chunk = Tile.getChunkForWriting(chunkPosition)
+            if chunk == None:
+                continue
+            chunk[layer][x % CHUNK_SIZE][y % CHUNK_SIZE] = tileTemplate
+            dirtyChunks.add(chunkPosition)
+        Tile.markChunksDirty(dirtyChunks, layer)
+
+    @staticmethod
+    def addTile(gridPosition, tileTemplate, layer):
+        """gridPosition is in tilemap coordinates, has to be an integer"""
+        Tile.setCells([(int(gridPosition.x), int(gridPosition.y))], tileTemplate, layer)
+
+    @staticmethod
+    def removeTileAtPos(gridPosition, layer): # removes a tile
+        Tile.setCells([(int(gridPosition.x), int(gridPosition.y))], None, layer)
+
+    @staticmethod
+    def getLineCells(startGridPosition, endGridPosition):
+        """Returns every cell on the line between the two grid positions (Bresenham's line algorithm), this is used so fast mouse movements don't skip cells"""
+        x0, y0 = int(startGridPosition.x), int(startGridPosition.y)
+        x1, y1 = int(endGridPosition.x), int(endGridPosition.y)
+        dx = abs(x1 - x0)
+        dy = -abs(y1 - y0)
+        stepX = 1 if x0 < x1 else -1
+        stepY = 1 if y0 < y1 else -1
+        error = dx + dy
+        cells = []
+        while True:
+            cells.append((x0, y0))
+            if x0 == x1 and y0 == y1:
+                return cells
+            doubleError = 2 * error
+            if doubleError >= dy:
+                error += dy
+                x0 += stepX
+            if doubleError <= dx:
+                error += dx
+                y0 += stepY
+
+    @staticmethod
+    def drawStroke(startGridPosition, endGridPosition, tileTemplate, layer):
+        """Paints (or erases if tileTemplate is None) a line of tiles between two mouse samples"""
+        Tile.setCells(Tile.getLineCells(startGridPosition, endGridPosition), tileTemplate, layer)
+
     @staticmethod
-    def removeTileAtPos(gridPosition): # removes a tile
-        t = Tile.tilemap[int(gridPosition.x)][int(gridPosition.y)]
-        if t == None:
-            #print(f"Invalid tile, could not remove tile at {gridPosition.x}, {gridPosition.y}")
+    def fillColumn(x, startY, endY, tileTemplate, layer):
+        """Fills the cells from startY to endY (inclusive) in column x, one slice assignment per chunk. Returns the chunks that were changed"""
+        changedChunks = []
+        for cy in range(startY // CHUNK_SIZE, endY // CHUNK_SIZE + 1):
+            sliceStart = max(startY, cy * CHUNK_SIZE) - cy * CHUNK_SIZE
+            sliceEnd = min(endY, cy * CHUNK_SIZE + CHUNK_SIZE - 1) - cy * CHUNK_SIZE
+            chunkPosition = (x // CHUNK_SIZE, cy)
+            chunk = Tile.getChunkForWriting(chunkPosition)
+            if chunk == None:
+                continue
+            chunk[layer][x % CHUNK_SIZE][sliceStart:sliceEnd + 1] = [tileTemplate] * (sliceEnd - sliceStart + 1)
+            changedChunks.append(chunkPosition)
+        return changedChunks
+
+    @staticmethod
+    def fillRect(startGridPosition, endGridPosition, tileTemplate, layer):
+        """Fills the rectangle between the two corners (inclusive) with tileTemplate (None clears it), the corners can be in any order"""
+        startX = int(min(startGridPosition.x, endGridPosition.x))
+        endX = int(max(startGridPosition.x, endGridPosition.x))
+        startY = int(min(startGridPosition.y, endGridPosition.y))
+        endY = int(max(startGridPosition.y, endGridPosition.y))
+
+        for x in range(startX, endX + 1):
+            Tile.fillColumn(x, startY, endY, tileTemplate, layer)
+        Tile.markDirtyRect(startX, startY, endX, endY, layer)
+
+    @staticmethod
+    def floodFill(gridPosition, tileTemplate, layer):
+        """Replaces the area of connected cells on a layer with the same template as the cell at gridPosition (empty cells count as an area too).
+        Regions are loaded as the fill reaches them. The fill covers at most FLOOD_FILL_CHUNK_RADIUS chunks around the chunk it starts in,
+        otherwise filling an open area would never end, a message is printed if the area goes on past that"""
+        x, y = int(gridPosition.x), int(gridPosition.y)
+        chunks = Tile.chunks
+        # the edges of the fill area are on chunk edges, so whole chunk segments are always either inside or outside of it
+        minX = (x // CHUNK_SIZE - FLOOD_FILL_CHUNK_RADIUS) * CHUNK_SIZE
+        maxX = (x // CHUNK_SIZE + FLOOD_FILL_CHUNK_RADIUS + 1) * CHUNK_SIZE - 1
+        minY = (y // CHUNK_SIZE - FLOOD_FILL_CHUNK_RADIUS) * CHUNK_SIZE
+        maxY = (y // CHUNK_SIZE + FLOOD_FILL_CHUNK_RADIUS + 1) * CHUNK_SIZE - 1
+
+        def getColumn(cellX, cellY, isInFillArea = True): # the part of column cellX stored in the chunk containing cellY, None if it is outside the fill area or its region can't be loaded
+            if isInFillArea and (cellX < minX or cellX > maxX or cellY < minY or cellY > maxY):
+                return None
+            chunk = chunks.get((cellX // CHUNK_SIZE, cellY // CHUNK_SIZE))
+            if chunk == None:
+                if not RegionStreamer.loadRegionNow((cellX // CHUNK_SIZE // REGION_SIZE, cellY // CHUNK_SIZE // REGION_SIZE)):
+                    return None
+                chunk = chunks[(cellX // CHUNK_SIZE, cellY // CHUNK_SIZE)]
+            return chunk[layer][cellX % CHUNK_SIZE]
+
+        column = getColumn(x, y)
+        if column == None:
             return
-        Tile.tilemap[int(gridPosition.x)][int(gridPosition.y)] = None
-    
+        targetTemplate = column[y % CHUNK_SIZE]
+        if targetTemplate == tileTemplate:
+            return
+        isCutOff = False # if the area continues past the edge of the fill area
+
+        # scanline fill: every step fills a whole vertical span of a column, then looks for spans to fill in the neighbouring columns
+        changedChunks = set()
+        stack = [(x, y)]
+        while stack:
+            x, y = stack.pop()
+            column = getColumn(x, y)
+            if column == None or column[y % CHUNK_SIZE] != targetTemplate:
+                continue
+            top = y
+            while True: # walk up one chunk at a time, whole chunk segments are checked at once
+                column = getColumn(x, top)
+                localTop = top % CHUNK_SIZE
+                if column[:localTop].count(targetTemplate) == localTop:
+                    localTop = 0
+                else:
+                    while column[localTop - 1] == targetTemplate:
+                        localTop -= 1
+                top += localTop - top % CHUNK_SIZE
+                aboveColumn = getColumn(x, top - 1)
+                if localTop > 0 or aboveColumn == None or aboveColumn[CHUNK_SIZE - 1] != targetTemplate:
+                    break
+                top -= 1
+            bottom = y
+            while True: # walk down the same way
+                column = getColumn(x, bottom)
+                localBottom = bottom % CHUNK_SIZE
+                if column[localBottom:].count(targetTemplate) == CHUNK_SIZE - localBottom:
+                    localBottom = CHUNK_SIZE - 1
+                else:
+                    while column[localBottom + 1] == targetTemplate:
+                        localBottom += 1
+                bottom += localBottom - bottom % CHUNK_SIZE
+                belowColumn = getColumn(x, bottom + 1)
+                if localBottom < CHUNK_SIZE - 1 or belowColumn == None or belowColumn[0] != targetTemplate:
+                    break
+                bottom += 1
+            changedChunks.update(Tile.fillColumn(x, top, bottom, tileTemplate, layer))
+
+            if not isCutOff and top == minY: # the cells just past the edges are only read to tell if the fill was cut off
+                outsideColumn = getColumn(x, top - 1, False)
+                isCutOff = outsideColumn != None and outsideColumn[CHUNK_SIZE - 1] == targetTemplate
+            if not isCutOff and bottom == maxY:
+                outsideColumn = getColumn(x, bottom + 1, False)
+                isCutOff = outsideColumn != None and outsideColumn[0] == targetTemplate
+
+            for neighbourX in (x - 1, x + 1):
+                if neighbourX < minX or neighbourX > maxX:
+                    for cy in range(top // CHUNK_SIZE, bottom // CHUNK_SIZE + 1):
+                        if isCutOff:
+                            break
+                        outsideColumn = getColumn(neighbourX, cy * CHUNK_SIZE, False)
+                        segmentStart = max(top, cy * CHUNK_SIZE) - cy * CHUNK_SIZE
+                        segmentEnd = min(bottom, cy * CHUNK_SIZE + CHUNK_SIZE - 1) - cy * CHUNK_SIZE
+                        isCutOff = outsideColumn != None and targetTemplate in outsideColumn[segmentStart:segmentEnd + 1]
+                    continue
+                inSpan = False
+                for cy in range(top // CHUNK_SIZE, bottom // CHUNK_SIZE + 1):
+                    neighbourColumn = getColumn(neighbourX, cy * CHUNK_SIZE)
+                    segmentStart = max(top, cy * CHUNK_SIZE) - cy * CHUNK_SIZE
+                    segmentEnd = min(bottom, cy * CHUNK_SIZE + CHUNK_SIZE - 1) - cy * CHUNK_SIZE
+                    if neighbourColumn == None: # unloaded cells are never part of the area
+                        inSpan = False
+                        continue
+                    targetCount = neighbourColumn[segmentStart:segmentEnd + 1].count(targetTemplate)
+                    if targetCount == 0:
+                        inSpan = False
+                        continue
+                    if targetCount == segmentEnd - segmentStart + 1: # the whole segment is part of the area
+                        if not inSpan:
+                            stack.append((neighbourX, cy * CHUNK_SIZE + segmentStart))
+                            inSpan = True
+                        continue
+                    for neighbourY in range(cy * CHUNK_SIZE + segmentStart, cy * CHUNK_SIZE + segmentEnd + 1):
+                        if neighbourColumn[neighbourY % CHUNK_SIZE] == targetTemplate:
+                            if not inSpan:
+                                stack.append((neighbourX, neighbourY))
+                                inSpan = True
+                        else:
+                            inSpan = False
+        Tile.markChunksDirty(changedChunks, layer)
+        if isCutOff:
+            print(f"The fill stopped {FLOOD_FILL_CHUNK_RADIUS * CHUNK_SIZE} tiles away from where it started, the area goes on past that and was only partly filled")
+
+    @staticmethod
+    def redrawChunk(chunkPosition):
+        """Rebuilds the cached composite of a chunk from the cached surfaces of its visible layers, only the layers that were edited are redrawn"""
+        surface = None
+        for layer in Layer.layers:
+            if not layer.isVisible:
+                continue
+            if chunkPosition in layer.dirtyChunks:
+                layer.redrawChunk(chunkPosition)
+            layerSurface = layer.chunkSurfaces.get(chunkPosition)
+            if layerSurface == None:
+                continue
+            if surface == None:
+                surface = pygame.Surface((CHUNK_SIZE * GRID_SIZE, CHUNK_SIZE * GRID_SIZE), pygame.SRCALPHA)
+            surface.blit(layerSurface, (0, 0))
+
+        if surface == None: # don't keep surfaces around for empty chunks
+            Tile.chunkSurfaces.pop(chunkPosition, None)
+        else:
+            Tile.chunkSurfaces[chunkPosition] = surface
+
     @staticmethod
     def drawAllTiles(): 
-        """This must be called every frame to draw all the tiles"""
-        for i in range(len(Tile.tilemap)):
-            for j in range(len(Tile.tilemap)):
-                if Tile.tilemap[i][j] != None:
-                    Tile.tilemap[i][j].drawTile()
+        """This must be called every frame to draw all the tiles, only visible chunks that were changed since they were last drawn are redrawn.
+        Surfaces of chunks that haven't been drawn recently are thrown away when they use more than CHUNK_SURFACE_MEMORY_BUDGET"""
+        left, top, right, bottom = Camera.getVisibleWorldRect()
+        chunkWorldSize = CHUNK_SIZE * GRID_SIZE
+        visibleChunkCount = 0
+        for cx in range(math.floor((left + GRID_SIZE / 2) / chunkWorldSize), math.floor((right + GRID_SIZE / 2) / chunkWorldSize) + 1):
+            for cy in range(math.floor((top + GRID_SIZE / 2) / chunkWorldSize), math.floor((bottom + GRID_SIZE / 2) / chunkWorldSize) + 1):
+                chunkPosition = (cx, cy)
+                if chunkPosition not in Tile.chunks:
+                    continue
+                if chunkPosition in Tile.dirtyChunks:
+                    Tile.redrawChunk(chunkPosition)
+                    Tile.dirtyChunks.remove(chunkPosition)
+                Tile.surfaceUsage[chunkPosition] = None
+                Tile.surfaceUsage.move_to_end(chunkPosition)
+                visibleChunkCount += 1
+                surface = Tile.chunkSurfaces.get(chunkPosition)
+                if surface != None:
+                    Camera.drawTexture(surface, pygame.Vector2(cx, cy) * chunkWorldSize - pygame.Vector2(GRID_SIZE / 2, GRID_SIZE / 2))
+
+        # the visible chunks were drawn last, so they are never the least recently drawn
+        while Tile.getSurfaceMemoryUsage() > CHUNK_SURFACE_MEMORY_BUDGET and len(Tile.surfaceUsage) > visibleChunkCount:
+            Tile.unloadChunkSurfaces(next(iter(Tile.surfaceUsage)))
+
+    @staticmethod
+    def getSurfaceMemoryUsage():
+        """Estimate of the bytes used by the cached composites and layer surfaces of the chunks"""
+        surfaceCount = len(Tile.chunkSurfaces) + sum(len(layer.chunkSurfaces) for layer in Layer.layers)
+        return surfaceCount * Tile.chunkSurfaceBytes
+
+    @staticmethod
+    def unloadChunkSurfaces(chunkPosition):
+        """Throws away the cached surfaces of a chunk, they are redrawn from the tilemap the next time the chunk is drawn"""
+        del Tile.surfaceUsage[chunkPosition]
+        if Tile.chunkSurfaces.pop(chunkPosition, None) != None:
+            Tile.dirtyChunks.add(chunkPosition)
+        for layer in Layer.layers:
+            if layer.chunkSurfaces.pop(chunkPosition, None) != None:
+                layer.dirtyChunks.add(chunkPosition)
+                Tile.dirtyChunks.add(chunkPosition)
     
     @staticmethod
-    def removeTileByTemplate(template): # remove all tiles using this tile template
-        for i in range(len(Tile.tilemap)):
-            for j in range(len(Tile.tilemap[i])):
-                if Tile.tilemap[i][j] != None and Tile.tilemap[i][j].tileTemplate == template:
-                    Tile.removeTileAtPos(pygame.Vector2(i, j))
+    def removeTileByTemplate(template): # remove all loaded tiles using this tile template
+        for layer in Layer.layers:
+            dirtyChunks = set()
+            for chunkPosition, chunk in Tile.chunks.items():
+                for column in chunk[layer.index]:
+                    for j in range(CHUNK_SIZE):
+                        if column[j] == template:
+                            column[j] = None
+                            dirtyChunks.add(chunkPosition)
+            Tile.markChunksDirty(dirtyChunks, layer.index)
 
 class TileTemplate: # this is for the "template" of each tile
     selectedTile = None
@@ -98,6 +442,7 @@ class TileTemplate: # this is for the "template" of each tile
     def __init__(self, texture, id, previewImg, texturePath):
 
         self.texture = texture
+        self.gridTexture = pygame.transform.scale(texture, (GRID_SIZE, GRID_SIZE)) # scaled once here so chunks don't have to scale the texture for every tile
         self.id = id
         self.previewImg = previewImg
         self.texturePath = texturePath
@@ -135,7 +480,8 @@ class TileTemplate: # this is for the "template" of each tile
         return TileTemplate(newTileImg, len(TileTemplate.tiles), newTileImgPreview, texturePath)
 
     @staticmethod
-    def removeTileTemplate(templateToRemove):
+    def removeTileTemplate(templateToRemove, removeTiles = True):
+        """If removeTiles is True, the tiles using this template are removed from the tilemap and every region file"""
         # Shift all gui elements to the left
 
         index = TileTemplate.tiles.index(templateToRemove)
@@ -148,8 +494,15 @@ class TileTemplate: # this is for the "template" of each tile
             TileTemplate.tiles[i].idText.pos.x -= 60
             TileTemplate.tiles[i].idText.changeText(TileTemplate.tiles[i].idText.text)
 
+        if removeTiles:
+            templateKeys = [(t.texturePath, t.id) for t in TileTemplate.tiles]
+            Tile.removeTileByTemplate(templateToRemove)
+            for placeholder in list(MissingTileTemplate.placeholders.values()): # placeholders that would now be matched to this template
+                if SaveSystem.MatchTemplateKey((placeholder.texturePath, placeholder.id), templateKeys) == index:
+                    Tile.removeTileByTemplate(placeholder)
+            RegionStreamer.removeTemplateFromRegions(templateKeys, index)
+
         # Remove all GUI elements on the templateToRemove
-        Tile.removeTileByTemplate(templateToRemove)
         GuiLib.GUI.removeElement(templateToRemove.button)
         GuiLib.GUI.removeElement(templateToRemove.idText)
         GuiLib.GUI.removeElement(templateToRemove.increaseIdButton)
@@ -165,6 +518,20 @@ class TileTemplate: # this is for the "template" of each tile
                 return tileTemplate
         return None
     
+class MissingTileTemplate: # stands in for a template that a region file uses but isn't loaded, so its tiles are kept and written back unchanged
+    placeholders = {} # (texture path, id) -> MissingTileTemplate, there is only one placeholder per key so their cells still compare equal
+
+    def __init__(self, texturePath, id):
+        self.texturePath = texturePath
+        self.id = id
+        self.gridTexture = None # placeholders are not drawn
+
+    @staticmethod
+    def getPlaceholder(templateKey):
+        if templateKey not in MissingTileTemplate.placeholders:
+            MissingTileTemplate.placeholders[templateKey] = MissingTileTemplate(templateKey[0], templateKey[1])
+        return MissingTileTemplate.placeholders[templateKey]
+
 class Camera: # camera class makes it easy to offset things drawn in pygame by the position of the camera.
     size = pygame.Vector2(0, 0) # currently the objects drawn by the camera do not scale with its size, this can be added later
     screen = None
@@ -189,7 +556,18 @@ class Camera: # camera class makes it easy to offset things drawn in pygame by t
         mousePos += pygame.Vector2(Camera.pos.x, -Camera.pos.y)
         mousePos += pygame.Vector2(-Camera.size.x / 2, -Camera.size.y / 2)
         return mousePos
-    
+
+    @staticmethod
+    def getGridPos(screenPos) -> pygame.Vector2:
+        """Returns the grid position of the cell under a position on the screen"""
+        worldPos = Camera.getWorldMousePos(pygame.Vector2(screenPos[0], screenPos[1]))
+        return pygame.Vector2(round(worldPos.x / GRID_SIZE), round(worldPos.y / GRID_SIZE))
+
+    @staticmethod
+    def getVisibleWorldRect():
+        """Returns the (left, top, right, bottom) edges of the area the camera can see in world coordinates"""
+        return (Camera.pos.x - Camera.size.x / 2, -Camera.pos.y - Camera.size.y / 2, Camera.pos.x + Camera.size.x / 2, -Camera.pos.y + Camera.size.y / 2)
+
     @staticmethod
     def drawTexture(texture, pos, size = pygame.Vector2(-1, -1)):
         """Draws a texture in world coordinates, if the size is pygame.Vector2(-1, -1), the size of the original texture will be used"""
@@ -197,6 +575,233 @@ class Camera: # camera class makes it easy to offset things drawn in pygame by t
             texture = pygame.transform.scale(texture, size)
         Camera.screen.blit(texture, pos + pygame.Vector2(-Camera.pos.x, Camera.pos.y) + pygame.Vector2(Camera.size.x / 2, Camera.size.y / 2))
 
+class RegionStreamer: # streams regions of the tilemap between memory and the region files, regions near the camera are loaded on a background thread.
+    # the region files are only a working copy of the tilemap being edited, the saved tilemap is the tilemap file
+    loadedRegions = OrderedDict() # region position -> None, ordered from least to most recently used
+    dirtyRegions = set() # loaded regions with changes that haven't been written to their file yet
+    pendingLoads = {} # region position -> number of the newest load request sent to the worker thread
+    failedRegions = set() # regions whose file could not be read, they are not loaded or written until the tilemap is loaded again
+    requestCount = 0
+    requests = queue.Queue() # (kind, region position, data) for the worker thread, they are handled in order so a region is never read before an older write to it is finished
+    finishedLoads = queue.Queue() # (region position, request number, chunk data) sent back by the worker thread, the chunk data is None if the file could not be read
+    undecodedChunks = {} # region position -> {(chunk position, layer): template keys} for chunk data the editor can't use (like unknown layers), it is written back unchanged
+    pendingWrites = {} # region position -> number of writes to its file that are queued, None is for jobs that rewrite every region file
+    writesFinished = threading.Condition() # guards pendingWrites, notified by the worker thread after every write
+    workerThread = None
+
+    regionGridBytes = len(LAYER_NAMES) * REGION_SIZE * REGION_SIZE * CHUNK_SIZE * (CHUNK_SIZE + 8) * 8 # rough size of the cell arrays of a region, 8 bytes per cell plus list overhead
+
+    @staticmethod
+    def start():
+        RegionStreamer.workerThread = threading.Thread(target=RegionStreamer.worker, daemon=True)
+        RegionStreamer.workerThread.start()
+
+    @staticmethod
+    def worker():
+        """Runs on the background thread, it only does the file IO so the tilemap is only ever changed by the main thread"""
+        while True:
+            kind, regionPosition, data = RegionStreamer.requests.get()
+            if kind == "load": # a result is always sent back, otherwise the region would stay pending forever
+                try:
+                    chunkData = SaveSystem.LoadRegion(regionPosition)
+                except Exception as e:
+                    print(f"Could not load region {regionPosition}, it won't be loaded or changed: {e}")
+                    chunkData = None
+                RegionStreamer.finishedLoads.put((regionPosition, data, chunkData))
+            else:
+                try:
+                    if kind == "save":
+                        SaveSystem.SaveRegion(regionPosition, CHUNK_SIZE, data)
+                    elif kind == "removeTemplate":
+                        SaveSystem.RemoveTemplateFromRegions(data[0], data[1])
+                except Exception as e:
+                    print(f"Error occured while streaming region {regionPosition}: {e}")
+                with RegionStreamer.writesFinished:
+                    RegionStreamer.pendingWrites[regionPosition] -= 1
+                    if RegionStreamer.pendingWrites[regionPosition] == 0:
+                        del RegionStreamer.pendingWrites[regionPosition]
+                    RegionStreamer.writesFinished.notify_all()
+            RegionStreamer.requests.task_done()
+
+    @staticmethod
+    def queueWrite(kind, regionPosition, data):
+        """Sends a write job to the worker thread and counts it, so loadRegionNow knows which writes it has to wait for. Waits first if too many writes are queued"""
+        with RegionStreamer.writesFinished:
+            RegionStreamer.writesFinished.wait_for(lambda: sum(RegionStreamer.pendingWrites.values()) < QUEUED_REGION_WRITE_LIMIT)
+            RegionStreamer.pendingWrites[regionPosition] = RegionStreamer.pendingWrites.get(regionPosition, 0) + 1
+        RegionStreamer.requests.put((kind, regionPosition, data))
+
+    @staticmethod
+    def getRegionChunkPositions(regionPosition):
+        return [(regionPosition[0] * REGION_SIZE + i, regionPosition[1] * REGION_SIZE + j) for i in range(REGION_SIZE) for j in range(REGION_SIZE)]
+
+    @staticmethod
+    def getRegionsNearCamera():
+        regionWorldSize = REGION_SIZE * CHUNK_SIZE * GRID_SIZE
+        regionX = math.floor((Camera.pos.x + GRID_SIZE / 2) / regionWorldSize)
+        regionY = math.floor((-Camera.pos.y + GRID_SIZE / 2) / regionWorldSize)
+        return [(regionX + i, regionY + j) for i in range(-REGION_LOAD_RADIUS, REGION_LOAD_RADIUS + 1) for j in range(-REGION_LOAD_RADIUS, REGION_LOAD_RADIUS + 1)]
+
+    @staticmethod
+    def getMemoryUsage():
+        """Estimate of the bytes used by the cells of the loaded regions, the chunk surfaces have their own budget"""
+        return len(RegionStreamer.loadedRegions) * RegionStreamer.regionGridBytes
+
+    @staticmethod
+    def update():
+        """This must be called every frame, it adds finished loads to the tilemap, requests the regions near the camera and unloads regions when over the memory budget"""
+        while True:
+            try:
+                regionPosition, requestNumber, chunkData = RegionStreamer.finishedLoads.get_nowait()
+            except queue.Empty:
+                break
+            if RegionStreamer.pendingLoads.get(regionPosition) == requestNumber: # older requests for the region are out of date
+                del RegionStreamer.pendingLoads[regionPosition]
+                if chunkData == None:
+                    RegionStreamer.failedRegions.add(regionPosition)
+                else:
+                    RegionStreamer.addRegion(regionPosition, chunkData)
+
+        nearRegions = RegionStreamer.getRegionsNearCamera()
+        for regionPosition in nearRegions:
+            if regionPosition in RegionStreamer.loadedRegions:
+                RegionStreamer.loadedRegions.move_to_end(regionPosition)
+            elif regionPosition not in RegionStreamer.pendingLoads and regionPosition not in RegionStreamer.failedRegions:
+                RegionStreamer.requestCount += 1
+                RegionStreamer.pendingLoads[regionPosition] = RegionStreamer.requestCount
+                RegionStreamer.requests.put(("load", regionPosition, RegionStreamer.requestCount))
+
+        RegionStreamer.unloadOverBudget()
+
+    @staticmethod
+    def unloadOverBudget(keptRegions = ()):
+        """Unloads the least recently used regions until the loaded regions fit in REGION_MEMORY_BUDGET, the regions near the camera and keptRegions are always kept"""
+        keptRegions = set(RegionStreamer.getRegionsNearCamera()).union(keptRegions)
+        while RegionStreamer.getMemoryUsage() > REGION_MEMORY_BUDGET:
+            leastRecentlyUsed = next((r for r in RegionStreamer.loadedRegions if r not in keptRegions), None)
+            if leastRecentlyUsed == None:
+                break
+            RegionStreamer.unloadRegion(leastRecentlyUsed, True)
+
+    @staticmethod
+    def addRegion(regionPosition, chunkData):
+        """Adds the chunks read from a region file to the tilemap, chunkData maps (chunk position, layer) to a list of (texture path, id) template keys"""
+        templateKeys = [(t.texturePath, t.id) for t in TileTemplate.tiles]
+        templatesByKey = {None: None} # every key is only matched once
+        missingKeys = set()
+        for chunkPosition in RegionStreamer.getRegionChunkPositions(regionPosition):
+            chunk = [[[None] * CHUNK_SIZE for i in range(CHUNK_SIZE)] for layer in Layer.layers]
+            for layer in Layer.layers:
+                tiles = chunkData.get((chunkPosition, layer.index))
+                if tiles == None or len(tiles) != CHUNK_SIZE * CHUNK_SIZE:
+                    continue
+                for i in range(CHUNK_SIZE):
+                    for j in range(CHUNK_SIZE):
+                        templateKey = tiles[i * CHUNK_SIZE + j]
+                        if templateKey not in templatesByKey:
+                            templateIndex = SaveSystem.MatchTemplateKey(templateKey, templateKeys)
+                            if templateIndex == None: # keep the tile so it isn't erased when the region is written again
+                                templatesByKey[templateKey] = MissingTileTemplate.getPlaceholder(templateKey)
+                                missingKeys.add(templateKey)
+                            else:
+                                templatesByKey[templateKey] = TileTemplate.tiles[templateIndex]
+                        chunk[layer.index][i][j] = templatesByKey[templateKey]
+                layer.dirtyChunks.add(chunkPosition)
+                Tile.dirtyChunks.add(chunkPosition)
+            Tile.chunks[chunkPosition] = chunk
+        regionChunkPositions = set(RegionStreamer.getRegionChunkPositions(regionPosition))
+        undecodedChunks = {chunkKey: tiles for chunkKey, tiles in chunkData.items() if chunkKey[0] not in regionChunkPositions or not Layer.isValidIndex(chunkKey[1]) or len(tiles) != CHUNK_SIZE * CHUNK_SIZE}
+        if len(undecodedChunks) > 0:
+            RegionStreamer.undecodedChunks[regionPosition] = undecodedChunks
+            print(f"Region {regionPosition} has {len(undecodedChunks)} chunks with a layer, position or chunk size that does not exist! they are kept but not loaded")
+        RegionStreamer.loadedRegions[regionPosition] = None
+        for templateKey in missingKeys:
+            print(f"Image path at {templateKey[0]} (Id: {templateKey[1]}) has no tile template! its tiles in region {regionPosition} are kept but not drawn")
+
+    @staticmethod
+    def loadRegionNow(regionPosition):
+        """Loads a region on the main thread, this is used when a region that isn't loaded yet is edited. Returns False if its file can't be read"""
+        if regionPosition in RegionStreamer.loadedRegions:
+            return True
+        if regionPosition in RegionStreamer.failedRegions:
+            return False
+        RegionStreamer.pendingLoads.pop(regionPosition, None)
+        with RegionStreamer.writesFinished: # only wait for queued writes to this region's file so the file is up to date, loads of other regions can keep going
+            RegionStreamer.writesFinished.wait_for(lambda: regionPosition not in RegionStreamer.pendingWrites and None not in RegionStreamer.pendingWrites)
+        try:
+            chunkData = SaveSystem.LoadRegion(regionPosition)
+        except Exception as e:
+            print(f"Could not load region {regionPosition}, it won't be loaded or changed: {e}")
+            RegionStreamer.failedRegions.add(regionPosition)
+            return False
+        RegionStreamer.addRegion(regionPosition, chunkData)
+        RegionStreamer.unloadOverBudget([regionPosition]) # bulk operations load regions through here, so they stay within the budget too
+        return True
+
+    @staticmethod
+    def getRegionTileKeys(regionPosition):
+        """Returns (chunk position, layer) -> list of (texture path, id) template keys for every chunk layer in the region that has tiles"""
+        chunkData = {}
+        keysByTemplate = {None: None}
+        for chunkPosition in RegionStreamer.getRegionChunkPositions(regionPosition):
+            for layer in Layer.layers:
+                columns = Tile.chunks[chunkPosition][layer.index]
+                if all(column.count(None) == CHUNK_SIZE for column in columns): # skip empty chunk layers without looking at every cell
+                    continue
+                tiles = [t for column in columns for t in column]
+                for t in set(tiles): # every template is only turned into a key once
+                    if t not in keysByTemplate:
+                        keysByTemplate[t] = (t.texturePath, t.id)
+                chunkData[(chunkPosition, layer.index)] = [keysByTemplate[t] for t in tiles]
+        chunkData.update(RegionStreamer.undecodedChunks.get(regionPosition, {}))
+        return chunkData
+
+    @staticmethod
+    def unloadRegion(regionPosition, save):
+        """Removes a region from memory, if save is True and it has unsaved changes it is written to its file on the worker thread"""
+        if save and regionPosition in RegionStreamer.dirtyRegions:
+            RegionStreamer.queueWrite("save", regionPosition, RegionStreamer.getRegionTileKeys(regionPosition))
+        RegionStreamer.dirtyRegions.discard(regionPosition)
+        RegionStreamer.undecodedChunks.pop(regionPosition, None)
+        for chunkPosition in RegionStreamer.getRegionChunkPositions(regionPosition):
+            Tile.chunks.pop(chunkPosition, None)
+            Tile.chunkSurfaces.pop(chunkPosition, None)
+            Tile.dirtyChunks.discard(chunkPosition)
+            Tile.surfaceUsage.pop(chunkPosition, None)
+            for layer in Layer.layers:
+                layer.chunkSurfaces.pop(chunkPosition, None)
+                layer.dirtyChunks.discard(chunkPosition)
+        del RegionStreamer.loadedRegions[regionPosition]
+
+    @staticmethod
+    def removeTemplateFromRegions(templateKeys, templateIndex):
+        """Removes the tiles of templateKeys[templateIndex] from every region file on the worker thread, the loaded regions have to be cleared separately"""
+        RegionStreamer.queueWrite("removeTemplate", None, (templateKeys, templateIndex))
+        RegionStreamer.pendingLoads.clear() # loads that were already queued would still have the removed tiles, so they are requested again
+
+    @staticmethod
+    def saveAll():
+        """Writes every region with unsaved changes to its file and waits until they are written"""
+        for regionPosition in RegionStreamer.dirtyRegions:
+            RegionStreamer.queueWrite("save", regionPosition, RegionStreamer.getRegionTileKeys(regionPosition))
+        RegionStreamer.dirtyRegions.clear()
+        RegionStreamer.requests.join()
+
+    @staticmethod
+    def unloadAll():
+        """Removes every region from memory without saving them, they are loaded again from their files when needed"""
+        for regionPosition in list(RegionStreamer.loadedRegions):
+            RegionStreamer.unloadRegion(regionPosition, False)
+        RegionStreamer.pendingLoads.clear()
+        RegionStreamer.failedRegions.clear() # files that were fixed can be read again
+
+    @staticmethod
+    def clearAll():
+        """Removes every region from memory and deletes the region files, this empties the tilemap being edited"""
+        RegionStreamer.unloadAll()
+        RegionStreamer.requests.join() # queued writes would create files again after they are deleted
+        SaveSystem.ClearRegions()
+
 # ----------------------- initializing things -------------------
 pygame.init()
 
@@ -208,6 +813,8 @@ Camera.size = pygame.Vector2(1024, 768)
 Camera.screen = screen
 
 GuiLib.GUI.initialize(screen)
+RegionStreamer.start()
+RegionStreamer.clearAll() # region files left from the last run have changes that weren't saved
 
 # Making a panel for the tiles to be displayed on (this is for decoration)
 tilePanel = GuiLib.Panel(pygame.Vector2(512, 720), pygame.Vector2(1024, 100), (230, 95, 85))
@@ -246,10 +853,8 @@ tileTemplateMoveLeftButton = GuiLib.Button(pygame.Vector2(22, 720), pygame.Vecto
 saveCompressed = True
 def saveButtonFunc():
     print("Saving tilemap and templates...")
-    if saveCompressed:
-        SaveSystem.SaveTilemapCompressed(Tile.tilemap)
-    else:
-        SaveSystem.SaveTilemap(Tile.tilemap)
+    RegionStreamer.saveAll() # the region files have to be up to date before they are exported
+    SaveSystem.SaveTilemapFromRegions([(t.texturePath, t.id) for t in TileTemplate.tiles], len(Layer.layers), saveCompressed) # the whole tilemap is exported from the region files, including regions that aren't loaded
     SaveSystem.SaveTileTemplates(TileTemplate.tiles)
 
 saveButtonImg = pygame.image.load("img/SaveIcon.png")
@@ -282,8 +887,9 @@ tilemapCompButton = GuiLib.Button(pygame.Vector2(350, 30), pygame.Vector2(60, 40
 def loadButtonFunc():
     print("Loading tilemap and templates...")
     # Loading the tile templates
-    for t in TileTemplate.tiles: # Remove all tile templates so there are no duplicates
-        TileTemplate.removeTileTemplate(t)
+    for t in list(TileTemplate.tiles): # Remove all tile templates so there are no duplicates, the tilemap is cleared below
+        TileTemplate.removeTileTemplate(t, False)
+    RegionStreamer.clearAll() # Clearing the tilemap, changes since the last save are thrown away
 
     tileTemplatesData = SaveSystem.LoadTileTemplates()
     for tileTemplateDataElement in tileTemplatesData: # parse the data
@@ -293,16 +899,10 @@ def loadButtonFunc():
         t = TileTemplate.addTileTemplate(tileTemplateDataElement["Path"])
         t.changeId(tileTemplateDataElement["Id"])
 
-    for i in range(len(Tile.tilemap)): # Clearing the tilemap
-        for j in range(len(Tile.tilemap[i])):
-            Tile.tilemap[i][j] = None
-    
-
-    # Loading the tilemap
-    tilemapData = SaveSystem.LoadTilemap()
+    # Loading the tilemap from the tilemap file one record at a time, regions are written to their region files when they are unloaded to stay in the memory budget
+    tilemapData = SaveSystem.IterateTilemap()
 
-    if tilemapData[0]["IsCompressed"] == True:
-        tilemapData.pop(0)
+    if next(tilemapData)["IsCompressed"] == True:
         for tileData in tilemapData:
             tileTemplate = TileTemplate.findTileTemplateById(tileData["Id"])
             if tileTemplate == None:
@@ -310,19 +910,23 @@ def loadButtonFunc():
                 continue
             startPos = tileData["StartPosition"]
             endPos = tileData["EndPosition"]
-            for i in range(startPos[0], endPos[0] + 1):
-                for j in range(startPos[1], endPos[1] + 1):
-                    pos = pygame.Vector2(i, j)
-                    Tile.addTile(pos, tileTemplate)
+            layer = tileData.get("Layer", 0) # files without layers only have the first layer
+            if not Layer.isValidIndex(layer):
+                print(f"Layer: {layer} does not exist! cannot load tiles from ({startPos[0]}, {startPos[1]}) to ({endPos[0]}, {endPos[1]})")
+                continue
+            Tile.fillRect(pygame.Vector2(startPos[0], startPos[1]), pygame.Vector2(endPos[0], endPos[1]), tileTemplate, layer)
     else:
-        tilemapData.pop(0)
         for tileData in tilemapData: # parse the data
             tileTemplate = TileTemplate.findTileTemplateById(tileData["Id"])
             if tileTemplate == None:
                 print(f"Id: {tileData['Id']} does not exist! cannot load tile at ({pos.x}, {pos.y})")
                 continue
             pos = pygame.Vector2(tileData["Position"][0], tileData["Position"][1])
-            Tile.addTile(pos, tileTemplate)
+            layer = tileData.get("Layer", 0) # files without layers only have the first layer
+            if not Layer.isValidIndex(layer):
+                print(f"Layer: {layer} does not exist! cannot load tile at ({pos.x}, {pos.y})")
+                continue
+            Tile.addTile(pos, tileTemplate, layer)
 
     print("Finished loading tilemap")
 
@@ -342,16 +946,37 @@ def addTileFunc():
 addTileButtonImg = pygame.image.load("img/PlusButton.png")
 addTileButton = GuiLib.Button(pygame.Vector2(980, 720), pygame.Vector2(50, 50), addTileButtonImg, addTileFunc)
 
+# ---------------------------- Painting Tools --------------------
+BRUSH_TOOL = "Brush" # paints and erases tiles under the mouse
+RECTANGLE_TOOL = "Rectangle" # fills or clears the rectangle between where the mouse was pressed and released
+FILL_TOOL = "Fill" # flood fills the area under the mouse
+toolKeys = {pygame.K_b: BRUSH_TOOL, pygame.K_r: RECTANGLE_TOOL, pygame.K_f: FILL_TOOL}
+currentTool = BRUSH_TOOL
+
+toolText = GuiLib.Text(pygame.Vector2(560, 30), 16, ROBOTO_REGULAR_PATH)
+toolText.changeText(f"Tool: {currentTool}")
+
+# ---------------------------- Layers --------------------
+for layerName in LAYER_NAMES:
+    Layer(layerName)
+Layer.setActiveLayer(0)
+layerKeys = {pygame.K_1 + i: i for i in range(min(len(LAYER_NAMES), 9))} # the number keys select the layer to paint on
+
 #-------------------- MAIN LOOP -------------------------
 mouseLeftButtonHeld = False # a bool to store if the left mouse button is held down
 mouseRightButtonHeld = False # a bool to store if the right mouse button is held down
+previousStrokeGridPos = None # grid position of the last brush sample, the next sample is connected to it with a line
+rectangleStartGridPos = None # grid position where the rectangle tool was pressed
+rectangleMouseButton = None # the mouse button that started the rectangle
 
 clock = pygame.time.Clock()
 deltaTime = 0 # time in seconds between each frame
 
 while running:
     deltaTime = clock.tick() / 1000
+    RegionStreamer.update()
 
+    mouseClicks = [] # (event type, button, screen position) of every left and right button press and release this frame, in order
     events = pygame.event.get()
     for event in events:
         if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
@@ -364,6 +989,18 @@ while running:
         elif event.type == pygame.MOUSEBUTTONUP and event.button == 3:
             mouseRightButtonHeld = False
 
+        if event.type in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP) and event.button in (1, 3):
+            mouseClicks.append((event.type, event.button, event.pos))
+
+        if event.type == pygame.KEYDOWN and event.key in layerKeys: # switch the layer that is painted on
+            Layer.setActiveLayer(layerKeys[event.key])
+
+        if event.type == pygame.KEYDOWN and event.key in toolKeys: # switch tools
+            currentTool = toolKeys[event.key]
+            toolText.changeText(f"Tool: {currentTool}")
+            previousStrokeGridPos = None
+            rectangleStartGridPos = None
+
     # Fill the background with grey
     screen.fill((255, 255, 255))
 
@@ -397,30 +1034,68 @@ while running:
     # draw a preview of the tile at the mouse poisition if it is selected
     if TileTemplate.selectedTile != None and (not positionIsOnGUI):
         Camera.drawTexture(TileTemplate.selectedTile.previewImg, mousePos, pygame.Vector2(30, 30))
-        if mouseLeftButtonHeld:
-            Tile.addTile(selectedTileGridPos, TileTemplate.selectedTile)
 
-    if not positionIsOnGUI and mouseRightButtonHeld:
-        # Removing tiles
-        Tile.removeTileAtPos(selectedTileGridPos)
+    # left click paints the selected tile, right click removes tiles
+    paintTemplate = None
+    isPainting = False
+    if mouseLeftButtonHeld and TileTemplate.selectedTile != None:
+        paintTemplate = TileTemplate.selectedTile
+        isPainting = True
+    elif mouseRightButtonHeld:
+        isPainting = True
+
+    # presses and releases are handled with the position they happened at and in the order they happened, so a click that starts and ends in the same frame isn't lost
+    for eventType, button, clickScreenPos in mouseClicks:
+        clickGridPos = Camera.getGridPos(clickScreenPos)
+        clickTemplate = TileTemplate.selectedTile if button == 1 else None
+        if eventType == pygame.MOUSEBUTTONDOWN:
+            if (button == 1 and TileTemplate.selectedTile == None) or GuiLib.GUI.positionIsOnGUI(pygame.Vector2(clickScreenPos[0], clickScreenPos[1])):
+                continue
+            if currentTool == BRUSH_TOOL: # paint the pressed cell, holding the button continues the stroke from it
+                Tile.drawStroke(clickGridPos, clickGridPos, clickTemplate, Layer.activeLayer)
+                previousStrokeGridPos = clickGridPos
+            elif currentTool == RECTANGLE_TOOL and rectangleStartGridPos == None:
+                rectangleStartGridPos = clickGridPos
+                rectangleMouseButton = button
+            elif currentTool == FILL_TOOL:
+                Tile.floodFill(clickGridPos, clickTemplate, Layer.activeLayer)
+        elif currentTool == RECTANGLE_TOOL and rectangleStartGridPos != None and button == rectangleMouseButton:
+            Tile.fillRect(rectangleStartGridPos, clickGridPos, clickTemplate, Layer.activeLayer)
+            rectangleStartGridPos = None
+
+    if currentTool == BRUSH_TOOL:
+        if isPainting and not positionIsOnGUI:
+            if previousStrokeGridPos == None:
+                previousStrokeGridPos = selectedTileGridPos
+            Tile.drawStroke(previousStrokeGridPos, selectedTileGridPos, paintTemplate, Layer.activeLayer) # connect this sample to the last one so fast drags don't skip cells
+            previousStrokeGridPos = selectedTileGridPos
+        else:
+            previousStrokeGridPos = None
 
     # ------------------------- draw the grid ----------------------
-    width = GRID_COLUMN_COUNT * GRID_SIZE
-    height = GRID_ROW_COUNT * GRID_SIZE
+    # the tilemap has no edges, so only the lines the camera can see are drawn
+    left, top, right, bottom = Camera.getVisibleWorldRect()
+    firstColumn = math.floor((left + GRID_SIZE / 2) / GRID_SIZE)
+    lastColumn = math.ceil((right + GRID_SIZE / 2) / GRID_SIZE)
+    firstRow = math.floor((top + GRID_SIZE / 2) / GRID_SIZE)
+    lastRow = math.ceil((bottom + GRID_SIZE / 2) / GRID_SIZE)
     gridColor = "#b8c7de"
-    for i in range(0, GRID_COLUMN_COUNT + 1): # draw thicker lines every 3 tiles
+    for i in range(firstColumn, lastColumn + 1): # draw thicker lines every 3 tiles
         if(i % 3 == 0):
-            Camera.drawLine(gridColor, pygame.Vector2(i * GRID_SIZE, 0) - pygame.Vector2(GRID_SIZE / 2, GRID_SIZE / 2), pygame.Vector2(i * GRID_SIZE, height) - pygame.Vector2(GRID_SIZE / 2, GRID_SIZE / 2), 2)
+            Camera.drawLine(gridColor, pygame.Vector2(i * GRID_SIZE, top) - pygame.Vector2(GRID_SIZE / 2, 0), pygame.Vector2(i * GRID_SIZE, bottom) - pygame.Vector2(GRID_SIZE / 2, 0), 2)
         else:
-            Camera.drawLine(gridColor, pygame.Vector2(i * GRID_SIZE, 0) - pygame.Vector2(GRID_SIZE / 2, GRID_SIZE / 2), pygame.Vector2(i * GRID_SIZE, height) - pygame.Vector2(GRID_SIZE / 2, GRID_SIZE / 2), 1)
-    for i in range(0, GRID_ROW_COUNT + 1):
+            Camera.drawLine(gridColor, pygame.Vector2(i * GRID_SIZE, top) - pygame.Vector2(GRID_SIZE / 2, 0), pygame.Vector2(i * GRID_SIZE, bottom) - pygame.Vector2(GRID_SIZE / 2, 0), 1)
+    for i in range(firstRow, lastRow + 1):
         if(i % 3 == 0):
-            Camera.drawLine(gridColor, pygame.Vector2(0, i * GRID_SIZE) - pygame.Vector2(GRID_SIZE / 2, GRID_SIZE / 2), pygame.Vector2(width, i * GRID_SIZE) - pygame.Vector2(GRID_SIZE / 2, GRID_SIZE / 2), 2)
+            Camera.drawLine(gridColor, pygame.Vector2(left, i * GRID_SIZE) - pygame.Vector2(0, GRID_SIZE / 2), pygame.Vector2(right, i * GRID_SIZE) - pygame.Vector2(0, GRID_SIZE / 2), 2)
         else:
-            Camera.drawLine(gridColor, pygame.Vector2(0, i * GRID_SIZE) - pygame.Vector2(GRID_SIZE / 2, GRID_SIZE / 2), pygame.Vector2(width, i * GRID_SIZE) - pygame.Vector2(GRID_SIZE / 2, GRID_SIZE / 2), 1)
+            Camera.drawLine(gridColor, pygame.Vector2(left, i * GRID_SIZE) - pygame.Vector2(0, GRID_SIZE / 2), pygame.Vector2(right, i * GRID_SIZE) - pygame.Vector2(0, GRID_SIZE / 2), 1)
 
 
     Tile.drawAllTiles()
+    if rectangleStartGridPos != None: # preview the rectangle while the mouse is held
+        rectangleSize = pygame.Vector2(abs(selectedTileGridPos.x - rectangleStartGridPos.x) + 1, abs(selectedTileGridPos.y - rectangleStartGridPos.y) + 1) * GRID_SIZE
+        Camera.drawBoxOutline("#e65f55", (rectangleStartGridPos + selectedTileGridPos) / 2 * GRID_SIZE, rectangleSize, 2)
     # GUI functions
     GuiLib.GUI.drawElements()
     GuiLib.GUI.checkInput(events)
@@ -432,5 +1107,6 @@ while running:
     # Flip the display
     pygame.display.flip()
 # Done! Time to quit.
+RegionStreamer.clearAll() # changes that weren't saved are not kept
 pygame.quit()
 sys.exit()
\ No newline at end of file
@@ -1,5 +1,7 @@
 import json
 import os
+import math
+import textwrap
 
 def SaveTileTemplates(tileTemplates, path = "TileFiles/tileTemplates.json"):
     tileTemplatesFile = open(path, "w")
@@ -20,80 +22,233 @@ def SaveTileTemplates(tileTemplates, path = "TileFiles/tileTemplates.json"):
     print("Finished saving tile templates")
     tileTemplatesFile.close()
 
-def SaveTilemap(tilemap, path = "TileFiles/tilemap.json"):
-    tilemapFile = open(path, "w")
+def GetTilemapRecords(tilemap): # tilemap maps (x, y, layer) to tile ids, returns a record for every tile
     outputList = []
 
-    outputList.append({"IsCompressed": False})
-
-    for i in range(len(tilemap)):
-        for j in range(len(tilemap[i])):
-            if(tilemap[i][j] != None):
-                tile = tilemap[i][j]
-                pos = tile.position
-                tileDict = {
-                    "Position": [pos.x, pos.y],
-                    "Id": tile.tileTemplate.id,
-                }
-                outputList.append(tileDict)
-
-    jsonObject = json.dumps(outputList, indent=2)
-    try:
-        tilemapFile.write(jsonObject)
-    except:
-        print("Error occured during saving tiles")
-    print("Finished saving tilemap")
-    tilemapFile.close()
+    for position in sorted(tilemap):
+        tileDict = {
+            "Position": [position[0], position[1]],
+            "Layer": position[2],
+            "Id": tilemap[position],
+        }
+        outputList.append(tileDict)
+    return outputList
 
  # I will use BFS to split the tilemap up into rectangles. This may not yield the minimum number of rectangles in some cases, but the solution to get the minimum is too complicated and slow.
-def SaveTilemapCompressed(tilemap, path="TileFiles/tilemap.json"):
-    visited = [[False] * len(tilemap[i]) for i in range(len(tilemap))]
+def GetTilemapRecordsCompressed(tilemap): # tilemap maps (x, y, layer) to tile ids, returns a record for every rectangle, every layer is split into its own rectangles
+    visited = set()
 
-    tilemapFile = open(path, "w")
     outputList = []
 
-    outputList.append({"IsCompressed": True})
-
-    for i in range(len(tilemap)):
-        for j in range(len(tilemap)):
-            if not visited[i][j] and tilemap[i][j] != None:
-                targetId = tilemap[i][j].tileTemplate.id
-                startTile = [i, j]
-                targetTile = [i, j] # first move x right until not possible, then move y down until not possible
-                while tilemap[targetTile[0] + 1][targetTile[1]] != None and tilemap[targetTile[0] + 1][targetTile[1]].tileTemplate.id == targetId and (not visited[targetTile[0] + 1][targetTile[1]]):
-                    visited[targetTile[0] + 1][targetTile[1]] = True
-                    targetTile[0] += 1
-                print(f"Target tile: {targetTile}, Start Tile: {startTile}")
-                # now expand down
+    for i, j, layer in sorted(tilemap):
+        if (i, j, layer) not in visited:
+            targetId = tilemap[(i, j, layer)]
+            startTile = [i, j]
+            targetTile = [i, j] # first move x right until not possible, then move y down until not possible
+            while tilemap.get((targetTile[0] + 1, targetTile[1], layer)) == targetId and (targetTile[0] + 1, targetTile[1], layer) not in visited:
+                visited.add((targetTile[0] + 1, targetTile[1], layer))
+                targetTile[0] += 1
+            # now expand down
+            canProceed = True
+            while canProceed:
                 canProceed = True
-                while canProceed:
-                    canProceed = True
+                for k in range(startTile[0], targetTile[0] + 1):
+                    if tilemap.get((k, targetTile[1] + 1, layer)) != targetId or (k, targetTile[1] + 1, layer) in visited:
+                        canProceed = False
+
+                if canProceed:
+                    targetTile[1] += 1
                     for k in range(startTile[0], targetTile[0] + 1):
-                        if tilemap[k][targetTile[1] + 1] == None or tilemap[k][targetTile[1] + 1].tileTemplate.id != targetId or visited[k][targetTile[1] + 1]:
-                            canProceed = False
+                        visited.add((k, targetTile[1], layer))
 
-                    if canProceed:
-                        targetTile[1] += 1
-                        for k in range(startTile[0], targetTile[0] + 1):
-                            visited[k][targetTile[1]] = True
+            rectDict = {
+                "StartPosition": [startTile[0], startTile[1]],
+                "EndPosition": [targetTile[0], targetTile[1]],
+                "Layer": layer,
+                "Id": targetId
+            }
 
-                rectDict = {
-                    "StartPosition": [startTile[0], startTile[1]],
-                    "EndPosition": [targetTile[0], targetTile[1]],
-                    "Id": targetId
-                }
+            outputList.append(rectDict)
+    return outputList
 
-                outputList.append(rectDict)
+# The tilemap is also stored in region files so the editor only has to keep the regions near the camera in memory.
+# Each region file holds a square block of chunks, and each layer of a chunk is a flat list of tiles (None for empty cells) ordered by x then y.
+# Tiles are stored as indexes into the region's palette, which lists the texture path and id of every template used in the region.
+# Ids can be changed at any time in the editor, so templates are matched by their texture path and the id is only used to tell apart templates with the same image.
+def MatchTemplateKey(templateKey, templateKeys):
+    """Returns the index of the template in templateKeys that a (texture path, id) key from a region file refers to, or None if there isn't one"""
+    matchIndex = None
+    for index, (texturePath, id) in enumerate(templateKeys):
+        if texturePath == templateKey[0]:
+            if id == templateKey[1]:
+                return index
+            if matchIndex == None:
+                matchIndex = index
+    return matchIndex
 
-    jsonObject = json.dumps(outputList, indent=2)
+def GetRegionPath(regionPosition, directory = "TileFiles/regions"):
+    return os.path.join(directory, f"region_{regionPosition[0]}_{regionPosition[1]}.json")
+
+def GetRegionPositions(directory = "TileFiles/regions"):
+    """Returns the positions of all the regions that have a file"""
+    if not os.path.isdir(directory):
+        return []
+    regionPositions = []
+    for fileName in os.listdir(directory):
+        parts = fileName[:-len(".json")].split("_")
+        if not fileName.endswith(".json") or len(parts) != 3 or parts[0] != "region":
+            continue
+        try:
+            regionPositions.append((int(parts[1]), int(parts[2])))
+        except ValueError: # not a region file, like region_a_b.json
+            continue
+    return regionPositions
+
+def ClearRegions(directory = "TileFiles/regions"):
+    """Deletes every region file, and any temporary file left by a write that didn't finish"""
+    if not os.path.isdir(directory):
+        return
+    for fileName in os.listdir(directory):
+        if fileName.startswith("region_") and (fileName.endswith(".json") or fileName.endswith(".json.tmp")):
+            os.remove(os.path.join(directory, fileName))
+
+def SaveRegion(regionPosition, chunkSize, chunks, directory = "TileFiles/regions"): # chunks maps (chunk position, layer) to lists of (texture path, id) template keys
+    path = GetRegionPath(regionPosition, directory)
+    if len(chunks) == 0: # don't keep files for empty regions
+        if os.path.isfile(path):
+            os.remove(path)
+        return
+
+    palette = {}
+    chunkList = []
+    for (chunkPosition, layer), templateKeys in chunks.items():
+        for templateKey in dict.fromkeys(templateKeys): # every key is only added once, in the order it first appears
+            if templateKey != None and templateKey not in palette:
+                palette[templateKey] = len(palette)
+        tiles = [palette.get(templateKey) for templateKey in templateKeys] # empty cells stay None
+        chunkDict = {"ChunkPosition": [chunkPosition[0], chunkPosition[1]], "Layer": layer, "Tiles": tiles}
+        if len(tiles) != chunkSize * chunkSize: # chunks kept from a file with a different chunk size store their own size
+            chunkDict["ChunkSize"] = math.isqrt(len(tiles))
+        chunkList.append(chunkDict)
+
+    os.makedirs(directory, exist_ok=True)
+    regionDict = {
+        "RegionPosition": [regionPosition[0], regionPosition[1]],
+        "ChunkSize": chunkSize,
+        "Palette": [{"Path": templateKey[0], "Id": templateKey[1]} for templateKey in palette],
+        "Chunks": chunkList
+    }
+    # write to a temporary file first so a region file is never left half written
+    regionFile = open(path + ".tmp", "w")
+    regionFile.write(json.dumps(regionDict))
+    regionFile.close()
+    os.replace(path + ".tmp", path)
+
+def LoadRegion(regionPosition, directory = "TileFiles/regions"):
+    """Returns a dictionary of (chunk position, layer) -> list of (texture path, id) template keys, it is empty if the region has no file.
+    Every chunk has ChunkSize * ChunkSize tiles, the chunk size of the file may not be the editor's. Raises ValueError if the file is not a valid region file"""
+    path = GetRegionPath(regionPosition, directory)
+    if not os.path.isfile(path):
+        return {}
+    regionFile = open(path, "r")
     try:
-        tilemapFile.write(jsonObject)
-    except:
-        print("Error occured during saving tiles")
+        parsedJsonData = json.loads(regionFile.read())
+    finally:
+        regionFile.close()
+
+    def isInt(value): # bools are ints in python but not in the file format
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    if not isinstance(parsedJsonData, dict) or not isinstance(parsedJsonData.get("Palette"), list) or not isinstance(parsedJsonData.get("Chunks"), list):
+        raise ValueError(f"{path} is not a region file")
+    regionChunkSize = parsedJsonData.get("ChunkSize")
+    if not isInt(regionChunkSize) or regionChunkSize <= 0:
+        raise ValueError(f"{path} has an invalid ChunkSize")
+    palette = []
+    for entry in parsedJsonData["Palette"]:
+        if not isinstance(entry, dict) or not isinstance(entry.get("Path"), str) or not isInt(entry.get("Id")):
+            raise ValueError(f"{path} has an invalid palette entry")
+        palette.append((entry["Path"], entry["Id"]))
+
+    chunks = {}
+    for c in parsedJsonData["Chunks"]:
+        if not isinstance(c, dict) or not isinstance(c.get("ChunkPosition"), list) or len(c["ChunkPosition"]) != 2 or not all(isInt(n) for n in c["ChunkPosition"]):
+            raise ValueError(f"{path} has a chunk without a valid ChunkPosition")
+        chunkSize = c.get("ChunkSize", regionChunkSize)
+        tiles = c.get("Tiles")
+        if not isInt(chunkSize) or chunkSize <= 0 or not isinstance(tiles, list) or len(tiles) != chunkSize * chunkSize:
+            raise ValueError(f"{path} has a chunk at {c['ChunkPosition']} without {chunkSize} x {chunkSize} tiles")
+        if not all(tile == None or (isInt(tile) and 0 <= tile < len(palette)) for tile in tiles):
+            raise ValueError(f"{path} has a chunk at {c['ChunkPosition']} with a tile that is not in the palette")
+        layer = c.get("Layer", 0) # files without layers only have the first layer
+        if not isInt(layer):
+            raise ValueError(f"{path} has a chunk at {c['ChunkPosition']} with an invalid layer")
+        chunks[((c["ChunkPosition"][0], c["ChunkPosition"][1]), layer)] = [(palette[tile] if tile != None else None) for tile in tiles]
+    return chunks
+
+def RemoveTemplateFromRegions(templateKeys, templateIndex, directory = "TileFiles/regions"):
+    """Removes every tile that is matched to templateKeys[templateIndex] from all the region files, this is used when a template is deleted"""
+    for regionPosition in GetRegionPositions(directory):
+        try:
+            chunks = LoadRegion(regionPosition, directory)
+        except Exception as e: # a broken file is left as it is
+            print(f"Could not read region {regionPosition}: {e}")
+            continue
+        isRemoved = {None: False} # every key is only matched once
+        isChanged = False
+        for chunkKey in list(chunks):
+            tiles = chunks[chunkKey]
+            for index, templateKey in enumerate(tiles):
+                if templateKey not in isRemoved:
+                    isRemoved[templateKey] = MatchTemplateKey(templateKey, templateKeys) == templateIndex
+                if isRemoved[templateKey]:
+                    tiles[index] = None
+                    isChanged = True
+            if all(templateKey == None for templateKey in tiles):
+                del chunks[chunkKey]
+        if isChanged:
+            chunkSize = math.isqrt(len(next(iter(chunks.values()), [0])))
+            SaveRegion(regionPosition, chunkSize, chunks, directory)
+
+def SaveTilemapFromRegions(templateKeys, layerCount, isCompressed, path = "TileFiles/tilemap.json", directory = "TileFiles/regions"):
+    """Exports every region file to the tilemap file one region at a time, so the whole tilemap never has to be in memory.
+    templateKeys is the (texture path, id) of every loaded template, tiles are exported with the current id of their template.
+    Tiles on layers outside 0 to layerCount - 1 are skipped. When compressed, rectangles don't cross the edges of regions"""
+    skippedTileCount = 0
+    # write to a temporary file first so the last saved tilemap is kept if something goes wrong
+    tilemapFile = open(path + ".tmp", "w")
+    try:
+        tilemapFile.write("[\n" + textwrap.indent(json.dumps({"IsCompressed": isCompressed}, indent=2), "  "))
+        for regionPosition in sorted(GetRegionPositions(directory)):
+            tilemap = {} # only holds the tiles of this region
+            for (chunkPosition, layer), tiles in LoadRegion(regionPosition, directory).items():
+                if not isinstance(layer, int) or layer < 0 or layer >= layerCount:
+                    skippedTileCount += sum(1 for templateKey in tiles if templateKey != None)
+                    continue
+                chunkSize = math.isqrt(len(tiles))
+                for index, templateKey in enumerate(tiles):
+                    if templateKey == None:
+                        continue
+                    templateIndex = MatchTemplateKey(templateKey, templateKeys)
+                    if templateIndex == None:
+                        skippedTileCount += 1
+                        continue
+                    tilemap[(chunkPosition[0] * chunkSize + index // chunkSize, chunkPosition[1] * chunkSize + index % chunkSize, layer)] = templateKeys[templateIndex][1]
+
+            records = GetTilemapRecordsCompressed(tilemap) if isCompressed else GetTilemapRecords(tilemap)
+            for record in records:
+                tilemapFile.write(",\n" + textwrap.indent(json.dumps(record, indent=2), "  "))
+        tilemapFile.write("\n]")
+        tilemapFile.close()
+        os.replace(path + ".tmp", path)
+    except Exception as e:
+        tilemapFile.close()
+        os.remove(path + ".tmp")
+        print(f"Error occured during saving tiles, the tilemap file was not changed: {e}")
+        return
+    if skippedTileCount > 0:
+        print(f"{skippedTileCount} tiles have no tile template or layer and were not saved to the tilemap file")
     print("Finished saving tilemap")
-    tilemapFile.close()
-                
-                
 
 def LoadTileTemplates(path = "TileFiles/tileTemplates.json"):
     tileTemplatesFile = open(path, "r")
@@ -107,6 +262,58 @@ def LoadTilemap(path = "TileFiles/tilemap.json"): # Data is parsed in LevelEdito
     tilemapFile.close()
     return parsedJsonData
 
+def IterateTilemap(path = "TileFiles/tilemap.json", readSize = 65536):
+    """Yields the elements of the tilemap file one at a time (the first one is the header), so a large tilemap never has to be in memory all at once"""
+    decoder = json.JSONDecoder()
+    tilemapFile = open(path, "r")
+    buffer = ""
+    position = 0
+    fileEnded = False
+
+    def readMore(): # the part of the buffer that is already parsed is dropped
+        nonlocal buffer, position, fileEnded
+        data = tilemapFile.read(readSize)
+        fileEnded = data == ""
+        buffer = buffer[position:] + data
+        position = 0
+
+    def nextCharacter(): # skips whitespace, returns "" at the end of the file
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or fileEnded:
+                return buffer[position:position + 1]
+            readMore()
+
+    try:
+        if nextCharacter() != "[":
+            raise ValueError(f"{path} is not a tilemap file")
+        position += 1
+        if nextCharacter() == "]":
+            return
+        while True:
+            nextCharacter()
+            while True: # read until the whole element is in the buffer
+                try:
+                    element, end = decoder.raw_decode(buffer, position)
+                    if end < len(buffer) or fileEnded:
+                        break
+                except json.JSONDecodeError:
+                    if fileEnded:
+                        raise
+                readMore()
+            position = end
+            yield element
+            character = nextCharacter()
+            position += 1
+            if character == "]":
+                return
+            if character != ",":
+                raise ValueError(f"{path} is not a tilemap file")
+    finally:
+        tilemapFile.close()
+
 def LoadTilemapCompressed(path = "TileFiles/tilemap.json"): # Data is parsed in LevelEditor.py
     tilemapFile = open(path, "r")
     parsedJsonData = json.loads(tilemapFile.read())